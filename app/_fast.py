@@ -0,0 +1,101 @@
+"""Per-frame box geometry kernels, compiled with Numba when available (NumPy fallback otherwise).
+Boxes are passed as one (N, 4) float32 xyxy array per frame.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to vectorized NumPy
+    njit = None
+
+
+def _accident_cluster_loop(b: np.ndarray, thr: float, min_overlap: int) -> int:
+    """Index of the first box overlapping (IoU >= thr) at least `min_overlap` others, or -1."""
+    k = b.shape[0]
+    if k == 0:
+        return -1
+    if min_overlap <= 0:
+        return 0
+    for i in range(k):
+        a1 = (b[i, 2] - b[i, 0]) * (b[i, 3] - b[i, 1])
+        count = 0
+        for j in range(k):
+            if i == j:
+                continue
+            iw = min(b[i, 2], b[j, 2]) - max(b[i, 0], b[j, 0])
+            ih = min(b[i, 3], b[j, 3]) - max(b[i, 1], b[j, 1])
+            if iw <= 0 or ih <= 0:
+                continue
+            inter = iw * ih
+            a2 = (b[j, 2] - b[j, 0]) * (b[j, 3] - b[j, 1])
+            if inter / max(a1 + a2 - inter, 1e-6) >= thr:
+                count += 1
+                if count >= min_overlap:
+                    return i
+    return -1
+
+
+def _boxes_in_zone_loop(b: np.ndarray, zx1: float, zy1: float, zx2: float, zy2: float) -> np.ndarray:
+    """Indices of boxes whose center lies inside the zone (inclusive)."""
+    out = np.empty(b.shape[0], dtype=np.int64)
+    n = 0
+    for i in range(b.shape[0]):
+        cx = (b[i, 0] + b[i, 2]) * 0.5
+        cy = (b[i, 1] + b[i, 3]) * 0.5
+        if zx1 <= cx <= zx2 and zy1 <= cy <= zy2:
+            out[n] = i
+            n += 1
+    return out[:n]
+
+
+def _pairwise_iou(b: np.ndarray) -> np.ndarray:
+    """IoU matrix (K, K) for a (K, 4) array of xyxy boxes."""
+    x1 = np.maximum(b[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(b[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(b[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(b[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area[:, None] + area[None, :] - inter, 1e-6)
+
+
+def _accident_cluster_numpy(b: np.ndarray, thr: float, min_overlap: int) -> int:
+    if b.shape[0] == 0:
+        return -1
+    overlaps = _pairwise_iou(b) >= thr
+    np.fill_diagonal(overlaps, False)
+    hits = np.flatnonzero(overlaps.sum(axis=1) >= min_overlap)
+    return int(hits[0]) if hits.size else -1
+
+
+def _boxes_in_zone_numpy(b: np.ndarray, zx1: float, zy1: float, zx2: float, zy2: float) -> np.ndarray:
+    cx = (b[:, 0] + b[:, 2]) * 0.5
+    cy = (b[:, 1] + b[:, 3]) * 0.5
+    return np.flatnonzero((cx >= zx1) & (cx <= zx2) & (cy >= zy1) & (cy <= zy2))
+
+
+if njit is not None:
+    accident_cluster = njit(cache=True, fastmath=True)(_accident_cluster_loop)
+    boxes_in_zone = njit(cache=True, fastmath=True)(_boxes_in_zone_loop)
+    # Compile now so the first frame does not pay JIT cost
+    _warm = np.zeros((1, 4), dtype=np.float32)
+    accident_cluster(_warm, 0.5, 1)
+    boxes_in_zone(_warm, 0.0, 0.0, 1.0, 1.0)
+else:
+    accident_cluster = _accident_cluster_numpy
+    boxes_in_zone = _boxes_in_zone_numpy
+
+
+def mask_contains(mask: int, ids: np.ndarray) -> np.ndarray:
+    """Boolean array: True where bit `ids[i]` of the int bitmask `mask` is set."""
+    ids = ids.astype(np.int64)
+    # shifts >= 64 are undefined for int64, so clamp and reject out-of-range ids separately
+    in_range = (ids >= 0) & (ids < 63)
+    return in_range & ((np.int64(mask) >> np.clip(ids, 0, 62)) & 1).astype(bool)
+
+
+def pack_boxes(boxes: list[tuple]) -> np.ndarray:
+    """Stack the xyxy of (xyxy, cls_id, conf, class_name) tuples into a contiguous (N, 4) float32 array."""
+    return np.ascontiguousarray(
+        np.asarray([item[0] for item in boxes], dtype=np.float32).reshape(-1, 4)
+    )
@@ -1,6 +1,9 @@
 """Traffic analytics: congestion level and suggestions."""
-from collections import deque
+import threading
 from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
 
 from app.detection import TrafficCounts
 
@@ -13,24 +16,40 @@ class TrafficState:
     suggestion: str
 
 
-# Rolling window of recent counts for smoothing
-_history: deque[TrafficCounts] = deque(maxlen=30)
+# Rolling window of recent totals for smoothing, kept as a ring buffer
+_HISTORY_LEN = 30
+_totals = np.zeros(_HISTORY_LEN, dtype=np.int32)
+_cursor = 0  # next slot to write
+_filled = 0  # number of valid slots
+_last_counts: Optional[TrafficCounts] = None
+# update_history runs concurrently from stream worker threads and the event loop
+_lock = threading.Lock()
 
 
 def update_history(counts: TrafficCounts) -> None:
-    _history.append(counts)
+    global _cursor, _filled, _last_counts
+    with _lock:
+        _totals[_cursor] = counts.total
+        _cursor = (_cursor + 1) % _HISTORY_LEN
+        _filled = min(_filled + 1, _HISTORY_LEN)
+        _last_counts = counts
+
+
+def get_last_counts() -> Optional[TrafficCounts]:
+    """Counts from the most recent frame, or None if nothing analyzed yet."""
+    return _last_counts
 
 
 def get_traffic_state() -> TrafficState:
     """Derive congestion level and suggestion from recent counts."""
-    if not _history:
+    with _lock:
+        avg_total = float(_totals[:_filled].mean()) if _filled else None
+    if avg_total is None:
         return TrafficState(
             level="low",
             message="No data yet",
             suggestion="Start a video or camera feed to analyze traffic.",
         )
-    recent = list(_history)
-    avg_total = sum(c.total for c in recent) / len(recent)
     if avg_total < 5:
         return TrafficState(
             level="low",
@@ -57,5 +76,8 @@ def get_traffic_state() -> TrafficState:
 
 
 def get_recent_totals() -> list[int]:
-    """Last N total counts for charts."""
-    return [c.total for c in _history]
+    """Last N total counts for charts, oldest first."""
+    with _lock:
+        if _filled < _HISTORY_LEN:
+            return _totals[:_filled].tolist()
+        return np.roll(_totals, -_cursor).tolist()
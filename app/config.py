@@ -8,6 +8,27 @@ YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8n.pt")
 # e.g. from Ultralytics hub or custom trained
 HELMET_MODEL = os.getenv("HELMET_MODEL", "")  # leave empty to disable
 
+# Frames per YOLO call when processing uploaded videos. Batching amortizes kernel
+# launch / host-to-device copies; capped at 16 to avoid GPU memory pressure.
+DETECT_BATCH_SIZE = max(1, min(int(os.getenv("DETECT_BATCH_SIZE", "8")), 16))
+
+# JPEG quality for annotated frames (streams and violation snapshots)
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "80"))
+
+# TensorRT FP16: export YOLO_MODEL to a cached .engine next to the weights on first
+# start and run that instead of the PyTorch graph (requires an NVIDIA GPU + TensorRT)
+TRT_FP16 = os.getenv("TRT_FP16", "0") == "1"
+
+# INT8: quantize YOLO_MODEL using representative traffic frames from CALIB_DIR
+# (200-500 images recommended). TensorRT engine on GPU, OpenVINO on CPU-only hosts.
+# Takes precedence over TRT_FP16.
+TRT_INT8 = os.getenv("TRT_INT8", "0") == "1"
+CALIB_DIR = os.getenv("CALIB_DIR", "")
+CALIB_MAX_IMAGES = 500
+
+# Square input size the model is exported / warmed up at
+MODEL_IMGSZ = 640
+
 # COCO classes relevant for traffic (cars, trucks, buses, motorcycles, persons)
 TRAFFIC_CLASS_IDS = {
     0: "person",
@@ -35,6 +56,12 @@ ACCIDENT_MIN_IOU = 0.2
 # Ambulance: class name we treat as ambulance (bus or add custom); or manual override
 AMBULANCE_CLASS_NAMES = {"bus"}  # can add "ambulance" if using custom model
 
+# Class-id bitmasks (bit i set = class id i) for cheap per-box membership tests
+TRAFFIC_CLASS_MASK = sum(1 << i for i in TRAFFIC_CLASS_IDS)
+AMBULANCE_CLASS_MASK = sum(
+    1 << i for i, name in TRAFFIC_CLASS_IDS.items() if name in AMBULANCE_CLASS_NAMES
+)
+
 # Challan amounts (INR or any currency) per violation type
 CHALLAN_AMOUNTS = {
     "lane_termination": 500,
@@ -1,5 +1,12 @@
 """YOLO-based traffic detection, violations (lane, accident, helmet), ambulance."""
-from collections import defaultdict
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 from dataclasses import dataclass, field
 from typing import Optional
 
@@ -7,12 +14,19 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 
+from app._fast import mask_contains, pack_boxes
 from app.config import (
-    AMBULANCE_CLASS_NAMES,
+    AMBULANCE_CLASS_MASK,
+    CALIB_DIR,
+    CALIB_MAX_IMAGES,
+    DETECT_BATCH_SIZE,
     DISPLAY_CLASSES,
     HELMET_MODEL,
-    LANE_TERMINATION_ZONE,
+    MODEL_IMGSZ,
     TRAFFIC_CLASS_IDS,
+    TRAFFIC_CLASS_MASK,
+    TRT_FP16,
+    TRT_INT8,
     YOLO_MODEL,
 )
 from app.violations import (
@@ -20,11 +34,26 @@ from app.violations import (
     check_accident,
     check_lane_termination,
     is_ambulance_priority,
+    lane_zone_px,
     set_accident_alert,
     set_ambulance_detected,
 )
 
+logger = logging.getLogger(__name__)
+
 VEHICLE_CLASSES = {"car", "truck", "bus", "motorcycle", "bicycle"}
+_ALLOWED_NAMES = DISPLAY_CLASSES | set(TRAFFIC_CLASS_IDS.values())
+
+# BGR box colors per class
+_COLORS = {
+    "car": (0, 165, 255),
+    "truck": (0, 140, 255),
+    "bus": (0, 215, 255),
+    "motorcycle": (203, 192, 255),
+    "bicycle": (255, 191, 0),
+    "person": (0, 255, 0),
+}
+_DEFAULT_COLOR = (200, 200, 200)
 
 
 @dataclass
@@ -48,11 +77,114 @@ class DetectionResult:
     ambulance_detected: bool = False
 
 
+def _downscale(frame_bgr: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """Shrink frames much larger than MODEL_IMGSZ before inference.
+    Returns (model_input, xyxy_scale) where xyxy_scale maps boxes back to the original frame (None if unchanged).
+    """
+    h, w = frame_bgr.shape[:2]
+    m = max(h, w)
+    if m <= MODEL_IMGSZ * 1.5:
+        return frame_bgr, None
+    nw, nh = MODEL_IMGSZ * w // m, MODEL_IMGSZ * h // m
+    small = cv2.resize(frame_bgr, (nw, nh), interpolation=cv2.INTER_AREA)
+    sx, sy = w / nw, h / nh
+    return small, np.array([sx, sy, sx, sy], dtype=np.float32)
+
+
+def _write_calib_yaml(out_dir: str, names: dict) -> str:
+    """Write a dataset YAML listing up to CALIB_MAX_IMAGES frames from CALIB_DIR for INT8 calibration."""
+    if not CALIB_DIR or not os.path.isdir(CALIB_DIR):
+        raise FileNotFoundError(f"CALIB_DIR {CALIB_DIR!r} is not a directory")
+    exts = (".jpg", ".jpeg", ".png", ".bmp")
+    images = sorted(
+        os.path.abspath(os.path.join(CALIB_DIR, f))
+        for f in os.listdir(CALIB_DIR)
+        if f.lower().endswith(exts)
+    )
+    if not images:
+        raise FileNotFoundError(f"No calibration images in {CALIB_DIR!r}")
+    # Evenly subsample so long recordings still cover the whole scene
+    step = max(1, len(images) // CALIB_MAX_IMAGES)
+    images = images[::step][:CALIB_MAX_IMAGES]
+    list_path = os.path.join(out_dir, "calib.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(images))
+    # JSON is valid YAML; Ultralytics only needs the image list and class names
+    yaml_path = os.path.join(out_dir, "calib.yaml")
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        json.dump({"train": list_path, "val": list_path, "names": names}, f, indent=2)
+    return yaml_path
+
+
+def _export_cached(
+    weights_path: str, cache_path: str, calib_names: Optional[dict] = None, **export_kwargs
+) -> YOLO:
+    """Load the exported model at `cache_path` (file or directory), exporting `weights_path` to it first if missing.
+
+    Ultralytics always writes `<stem>.engine` next to the weights whatever the precision, so the export
+    runs on a copy of the weights in a scratch directory and only the result is moved into place.
+    INT8 calibration data (`calib_names` given) is built there too, and only when an export is needed.
+    """
+    if not os.path.exists(cache_path):
+        workdir = tempfile.mkdtemp(prefix=".export_", dir=os.path.dirname(os.path.abspath(cache_path)))
+        try:
+            weights = shutil.copy2(weights_path, workdir)
+            if calib_names is not None:
+                export_kwargs["data"] = _write_calib_yaml(workdir, calib_names)
+            exported = YOLO(weights).export(**export_kwargs)
+            os.replace(exported, cache_path)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return YOLO(cache_path, task="detect")
+
+
+def _load_optimized(model: YOLO, model_path: str) -> YOLO:
+    """Return YOLO running an exported model, cached next to the weights.
+
+    Tried in order: INT8 (TRT_INT8: TensorRT on GPU, OpenVINO on CPU), then the TensorRT FP16
+    engine (TRT_FP16), then the given PyTorch model.
+    """
+    # Max batch and input size are fixed at export time, so they are part of the cache name:
+    # changing DETECT_BATCH_SIZE / MODEL_IMGSZ builds a new export instead of reusing a mismatched one
+    stem = f"{os.path.splitext(model_path)[0]}_b{DETECT_BATCH_SIZE}_{MODEL_IMGSZ}"
+    weights_path = getattr(model, "ckpt_path", None) or model_path
+    # dynamic batch so detect_batch() / warmup() can feed up to DETECT_BATCH_SIZE frames
+    shape_kwargs = dict(imgsz=MODEL_IMGSZ, dynamic=True, batch=DETECT_BATCH_SIZE)
+    engine_kwargs = dict(format="engine", device=0, **shape_kwargs)
+    if TRT_INT8:
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                return _export_cached(
+                    weights_path, stem + "_int8.engine", calib_names=model.names, int8=True, **engine_kwargs
+                )
+            return _export_cached(
+                weights_path, stem + "_int8_openvino_model", calib_names=model.names,
+                format="openvino", int8=True, **shape_kwargs,
+            )
+        except Exception:
+            fallback = "TensorRT FP16" if TRT_FP16 else "PyTorch"
+            logger.warning("INT8 export/load failed; falling back to %s", fallback, exc_info=True)
+    if TRT_FP16:
+        try:
+            return _export_cached(weights_path, stem + ".engine", half=True, **engine_kwargs)
+        except Exception:
+            logger.warning("TensorRT FP16 export/load failed; falling back to PyTorch", exc_info=True)
+    return model
+
+
 class TrafficDetector:
     """Runs YOLO and aggregates traffic-relevant detections + violations."""
 
     def __init__(self, model_path: str = YOLO_MODEL):
         self.model = YOLO(model_path)
+        if (TRT_FP16 or TRT_INT8) and model_path.endswith(".pt"):
+            self.model = _load_optimized(self.model, model_path)
+        # Ultralytics predictors are not thread-safe; handlers run in worker threads
+        self._lock = threading.Lock()
+        # TRAFFIC_CLASS_MASK narrowed to ids whose model class name we display; set on first frame
+        self._allowed_mask: Optional[int] = None
         self._helmet_model = None
         if HELMET_MODEL:
             try:
@@ -60,23 +192,48 @@ class TrafficDetector:
             except Exception:
                 pass
 
-    def _filter_traffic(self, results) -> tuple[list, TrafficCounts]:
-        boxes = []
-        by_class = defaultdict(int)
-        names = results[0].names if results else {}
-        if results and results[0].boxes is not None:
-            for box in results[0].boxes:
-                cls_id = int(box.cls[0])
-                if cls_id not in TRAFFIC_CLASS_IDS:
-                    continue
-                name = names.get(cls_id, "unknown")
-                if name not in DISPLAY_CLASSES and name not in TRAFFIC_CLASS_IDS.values():
-                    continue
-                conf = float(box.conf[0])
-                xyxy = box.xyxy[0].cpu().numpy()
-                boxes.append((xyxy, cls_id, conf, name))
-                by_class[name] += 1
-        counts = TrafficCounts(by_class=dict(by_class), total=sum(by_class.values()))
+    def warmup(self) -> None:
+        """Run dummy inferences so cuDNN autotune / engine and allocator setup is paid before the first request.
+        Uses a noise image (not zeros) so the post-processing path sees realistic work.
+        """
+        dummy = np.random.randint(0, 255, (MODEL_IMGSZ, MODEL_IMGSZ, 3), dtype=np.uint8)
+        with self._lock:
+            # first call triggers autotune / allocations, second runs on the warmed caches
+            self.model(dummy, verbose=False)
+            self.model(dummy, verbose=False)
+            # uploaded videos go through detect_batch: warm that input shape / engine profile too
+            if DETECT_BATCH_SIZE > 1:
+                self.model([dummy] * DETECT_BATCH_SIZE, verbose=False)
+            if self._helmet_model is not None:
+                self._helmet_model(dummy, verbose=False)
+
+    def _filter_traffic(self, results, scale: Optional[np.ndarray] = None) -> tuple[list, TrafficCounts]:
+        if not results or results[0].boxes is None:
+            return [], TrafficCounts()
+        names = results[0].names or {}
+        b = results[0].boxes
+        # One device->host copy per field instead of one per box
+        xyxy = b.xyxy.cpu().numpy()
+        cls = b.cls.cpu().numpy().astype(np.int32)
+        conf = b.conf.cpu().numpy()
+        if self._allowed_mask is None:
+            self._allowed_mask = TRAFFIC_CLASS_MASK & sum(
+                1 << cls_id for cls_id in TRAFFIC_CLASS_IDS
+                if names.get(cls_id, "unknown") in _ALLOWED_NAMES
+            )
+        keep = mask_contains(self._allowed_mask, cls)
+        xyxy, cls, conf = xyxy[keep], cls[keep], conf[keep]
+        if scale is not None:
+            xyxy = xyxy * scale
+        boxes = [
+            (xyxy[i], int(cls[i]), float(conf[i]), names[int(cls[i])])
+            for i in range(len(cls))
+        ]
+        by_class: dict[str, int] = {}
+        for cls_id, n in zip(*np.unique(cls, return_counts=True)):
+            name = names[int(cls_id)]
+            by_class[name] = by_class.get(name, 0) + int(n)
+        counts = TrafficCounts(by_class=by_class, total=len(boxes))
         return boxes, counts
 
     def _detect_helmet(self, frame_bgr: np.ndarray) -> list[Violation]:
@@ -85,7 +242,8 @@ class TrafficDetector:
             return []
         violations = []
         try:
-            r = self._helmet_model(frame_bgr, conf=0.4, verbose=False)
+            with self._lock:
+                r = self._helmet_model(frame_bgr, conf=0.4, verbose=False)
             if not r or not r[0].boxes:
                 return []
             names = r[0].names or {}
@@ -95,8 +253,6 @@ class TrafficDetector:
                 if name in ("without_helmet", "no_helmet", "no helmet"):
                     xyxy = box.xyxy[0].cpu().numpy()
                     conf = float(box.conf[0])
-                    import time
-                    import uuid
                     violations.append(
                         Violation(
                             id=str(uuid.uuid4()),
@@ -113,16 +269,43 @@ class TrafficDetector:
         return violations
 
     def detect(self, frame_bgr: np.ndarray, conf_threshold: float = 0.4) -> DetectionResult:
-        """Run YOLO on a BGR frame; run violation checks; return annotated frame + counts + violations."""
-        results = self.model(frame_bgr, conf=conf_threshold, verbose=False)
-        boxes, counts = self._filter_traffic(results)
-        out = frame_bgr.copy()
+        """Run YOLO on a BGR frame; run violation checks; return annotated frame + counts + violations.
+        The frame is annotated in place; pass a copy if the original pixels are still needed.
+        """
+        model_input, scale = _downscale(frame_bgr)
+        with self._lock:
+            results = self.model(model_input, conf=conf_threshold, verbose=False)
+        return self._build_result(frame_bgr, results, scale)
+
+    def detect_batch(
+        self, frames: list[np.ndarray], conf_threshold: float = 0.4
+    ) -> list[DetectionResult]:
+        """Run YOLO once on a list of BGR frames; return one DetectionResult per frame, in order.
+        Frames are annotated in place, as in detect().
+        """
+        if not frames:
+            return []
+        inputs, scales = zip(*(_downscale(f) for f in frames))
+        with self._lock:
+            results = self.model(list(inputs), conf=conf_threshold, verbose=False)
+        return [
+            self._build_result(frame, [r], scale)
+            for frame, r, scale in zip(frames, results, scales)
+        ]
+
+    def _build_result(
+        self, frame_bgr: np.ndarray, results, scale: Optional[np.ndarray] = None
+    ) -> DetectionResult:
+        """Filter, check violations and annotate one frame given its YOLO results.
+        `scale` maps boxes from a downscaled model input back to frame_bgr.
+        """
+        boxes, counts = self._filter_traffic(results, scale)
+        # Annotate in place: callers never reuse the raw frame, so skip a full-frame copy
+        out = frame_bgr
         h, w = out.shape[:2]
 
         # Ambulance: any bus (or ambulance class) in frame
-        ambulance_detected = any(
-            (item[3] if len(item) > 3 else "") in AMBULANCE_CLASS_NAMES for item in boxes
-        )
+        ambulance_detected = any((AMBULANCE_CLASS_MASK >> item[1]) & 1 for item in boxes)
         set_ambulance_detected(ambulance_detected)
 
         # Lane termination
@@ -141,11 +324,11 @@ class TrafficDetector:
         if accident_v:
             all_violations.append(accident_v)
 
-        # Draw boxes
-        for item in boxes:
-            xyxy, cls_id, conf = item[0], item[1], item[2]
+        # Draw boxes (pixel coords cast once for the whole frame)
+        all_xyxy_i = pack_boxes(boxes).astype(np.int32).tolist()
+        for item, (x1, y1, x2, y2) in zip(boxes, all_xyxy_i):
+            conf = item[2]
             name = item[3] if len(item) > 3 else "?"
-            x1, y1, x2, y2 = int(xyxy[0]), int(xyxy[1]), int(xyxy[2]), int(xyxy[3])
             color = self._color_for_class(name)
             cv2.rectangle(out, (x1, y1), (x2, y2), color, 2)
             label = f"{name} {conf:.1f}"
@@ -155,9 +338,7 @@ class TrafficDetector:
             )
 
         # Draw lane termination zone
-        xmin, ymin, xmax, ymax = LANE_TERMINATION_ZONE
-        zx1, zy1 = int(xmin * w), int(ymin * h)
-        zx2, zy2 = int(xmax * w), int(ymax * h)
+        zx1, zy1, zx2, zy2 = map(int, lane_zone_px(h, w))
         cv2.rectangle(out, (zx1, zy1), (zx2, zy2), (0, 0, 255), 2)
         cv2.putText(out, "NO ENTRY / LANE END", (zx1, zy1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
 
@@ -171,15 +352,7 @@ class TrafficDetector:
         )
 
     def _color_for_class(self, name: str) -> tuple[int, int, int]:
-        colors = {
-            "car": (0, 165, 255),
-            "truck": (0, 140, 255),
-            "bus": (0, 215, 255),
-            "motorcycle": (203, 192, 255),
-            "bicycle": (255, 191, 0),
-            "person": (0, 255, 0),
-        }
-        return colors.get(name, (200, 200, 200))
+        return _COLORS.get(name, _DEFAULT_COLOR)
 
 
 # Singleton for the app
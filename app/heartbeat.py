@@ -9,15 +9,55 @@ import threading
 import time
 import json
 import os
+import tempfile
 from typing import Dict, List, Optional, Tuple
 import urllib.parse
 import urllib.request
 
+try:
+    import orjson
+except ImportError:  # optional fast JSON encoder
+    orjson = None
+
 _lock = threading.Lock()
 # system_id -> info
 _systems: Dict[str, Dict] = {}
+# Immutable-by-convention copy of _systems for readers; replaced wholesale on every mutation
+_snapshot: Tuple[Dict, ...] = ()
 _data_file = os.path.join(os.path.dirname(__file__), "systems.json")
 
+# normalized area name -> (lat, lon); only successful lookups are cached
+_GEOCACHE_MAX = 1024
+_geocache: Dict[str, Tuple[float, float]] = {}
+_geocache_file = os.path.join(os.path.dirname(__file__), "geocache.json")
+
+# Heartbeats mark the store dirty; a timer writes it at most once per _SAVE_DELAY seconds
+_SAVE_DELAY = 1.0
+_save_timer: Optional[threading.Timer] = None
+# Serializes snapshot + write so an older snapshot never replaces a newer file.
+# Separate from _lock, which readers take.
+_write_lock = threading.Lock()
+
+
+def _write_json_atomic(path: str, data) -> None:
+    """Write `data` as indented JSON via a unique tmp file + os.replace."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        if orjson is not None:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600; keep the usual data-file permissions
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
 
 def _load_persisted() -> None:
     try:
@@ -29,24 +69,95 @@ def _load_persisted() -> None:
                         _systems.clear()
                         for k, v in data.items():
                             _systems[k] = v
+                        _rebuild_snapshot()
     except Exception:
         pass
 
 
+def _rebuild_snapshot() -> None:
+    """Publish a fresh snapshot of _systems. Caller must hold _lock."""
+    global _snapshot
+    _snapshot = tuple(dict(v) for v in _systems.values())
+
+
 def _save_persisted() -> None:
     try:
-        with _lock:
-            to_write = dict(_systems)
-        tmp = _data_file + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(to_write, f, indent=2, ensure_ascii=False)
-        os.replace(tmp, _data_file)
+        with _write_lock:
+            with _lock:
+                to_write = dict(_systems)
+            _write_json_atomic(_data_file, to_write)
+    except Exception:
+        pass
+
+
+def _schedule_save() -> None:
+    """Coalesce saves: start a flush timer unless one is already pending."""
+    global _save_timer
+    with _lock:
+        if _save_timer is not None:
+            return
+        _save_timer = threading.Timer(_SAVE_DELAY, flush_persisted)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+def flush_persisted() -> None:
+    """Write systems to disk now, cancelling any pending delayed save."""
+    global _save_timer
+    with _lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+    _save_persisted()
+
+
+def _load_geocache() -> None:
+    try:
+        if os.path.isfile(_geocache_file):
+            with open(_geocache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                if isinstance(data, dict):
+                    with _lock:
+                        for k, v in data.items():
+                            _geocache[k] = (float(v[0]), float(v[1]))
+    except Exception:
+        pass
+
+
+def _save_geocache() -> None:
+    try:
+        with _write_lock:
+            with _lock:
+                to_write = {k: list(v) for k, v in _geocache.items()}
+            _write_json_atomic(_geocache_file, to_write)
     except Exception:
         pass
 
 
 def geocode_area(area: str) -> Tuple[Optional[float], Optional[float]]:
-    """Server-side geocode using Nominatim. Returns (lat, lon) or (None, None)."""
+    """Server-side geocode using Nominatim. Returns (lat, lon) or (None, None).
+
+    Successful lookups are cached by normalized area name and persisted to
+    `geocache.json`, as Nominatim's usage policy asks clients to cache results.
+    This call blocks on the network; run it via `asyncio.to_thread` from async code.
+    """
+    key = area.strip().lower()
+    with _lock:
+        hit = _geocache.get(key)
+    if hit is not None:
+        return hit
+    lat, lon = _nominatim_lookup(key)
+    if lat is not None and lon is not None:
+        with _lock:
+            _geocache[key] = (lat, lon)
+            # evict oldest entries beyond the bound
+            while len(_geocache) > _GEOCACHE_MAX:
+                del _geocache[next(iter(_geocache))]
+        _save_geocache()
+    return lat, lon
+
+
+def _nominatim_lookup(area: str) -> Tuple[Optional[float], Optional[float]]:
     try:
         q = urllib.parse.urlencode({"q": area, "format": "json", "limit": 1})
         url = f"https://nominatim.openstreetmap.org/search?{q}"
@@ -80,14 +191,17 @@ def register_heartbeat(system_id: str, area: Optional[str] = None, lat: Optional
             "status": "online",
         })
         _systems[system_id] = info
-    # persist to disk
-    _save_persisted()
+        _rebuild_snapshot()
+    # persist to disk (debounced)
+    _schedule_save()
 
 
 def get_systems() -> List[Dict]:
-    """Return a shallow copy list of system infos."""
-    with _lock:
-        return [dict(v) for v in _systems.values()]
+    """Return a list of system infos without taking the lock.
+
+    The dicts are shared with other readers and must not be mutated.
+    """
+    return list(_snapshot)
 
 
 def sweep_offline(threshold_seconds: int = 120) -> None:
@@ -100,6 +214,8 @@ def sweep_offline(threshold_seconds: int = 120) -> None:
             if now - last > threshold_seconds and info.get("status") != "offline":
                 info["status"] = "offline"
                 changed = True
+        if changed:
+            _rebuild_snapshot()
     return changed
 
 
@@ -122,5 +238,6 @@ def start_sweeper(interval_seconds: int = 30, threshold_seconds: int = 120) -> t
     return t
 
 
-# Load persisted systems on import
+# Load persisted systems and geocode cache on import
 _load_persisted()
+_load_geocache()
@@ -1,15 +1,21 @@
 """FastAPI app: video upload, live detection, and dashboard."""
+import asyncio
 import os
+import shutil
+import tempfile
+import time
+import uuid
+from base64 import b64encode
 from contextlib import asynccontextmanager
 
 import cv2
 import numpy as np
 from fastapi import FastAPI, File, UploadFile, HTTPException, Body
-import uuid
-import time
 from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 
-from app.analytics import get_recent_totals, get_traffic_state, update_history
+from app.analytics import get_last_counts, get_recent_totals, get_traffic_state, update_history
+from app.config import DETECT_BATCH_SIZE, JPEG_QUALITY
 from app.detection import get_detector, DetectionResult
 from app.violations import (
     add_violations,
@@ -21,11 +27,12 @@ from app.violations import (
     is_ambulance_priority,
     set_ambulance_manual,
 )
-from app.heartbeat import register_heartbeat, get_systems, start_sweeper, geocode_area
+from app.heartbeat import register_heartbeat, get_systems, start_sweeper, geocode_area, flush_persisted
 
 # emergency reports store
 _emergencies: list[dict] = []
 
+_JPEG_PARAMS = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
 
 
 def run_detection_on_frame(frame_bgr: np.ndarray) -> DetectionResult:
@@ -33,18 +40,40 @@ def run_detection_on_frame(frame_bgr: np.ndarray) -> DetectionResult:
     return detector.detect(frame_bgr)
 
 
+def run_detection_on_batch(frames: list[np.ndarray]) -> list[DetectionResult]:
+    detector = get_detector()
+    return detector.detect_batch(frames)
+
+
+def _encode_jpeg(frame_bgr: np.ndarray) -> bytes:
+    _, jpeg = cv2.imencode(".jpg", frame_bgr, _JPEG_PARAMS)
+    return jpeg.tobytes()
+
+
+def _mjpeg_part(jpeg_bytes: bytes) -> bytes:
+    """One multipart/x-mixed-replace part as a single buffer (one ASGI body event per frame)."""
+    return b"".join((
+        b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ",
+        str(len(jpeg_bytes)).encode(),
+        b"\r\n\r\n",
+        jpeg_bytes,
+        b"\r\n",
+    ))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Pre-load YOLO model on startup
-    get_detector()
+    # Pre-load YOLO model on startup and warm it up before the first request
+    # (in a worker thread so the blocking load does not run on the event loop)
+    await asyncio.to_thread(lambda: get_detector().warmup())
     # start heartbeat sweeper (marks systems offline if no heartbeat for 2 minutes)
     try:
         start_sweeper(interval_seconds=30, threshold_seconds=120)
     except Exception:
         pass
     yield
-    # cleanup if needed
-    pass
+    # write any heartbeats still waiting on the debounced save
+    flush_persisted()
 
 
 app = FastAPI(
@@ -100,7 +129,7 @@ async def heartbeat(payload: dict = Body(...)):
         # if coords missing but area provided, try server-side geocode
         if (lat is None or lon is None) and area:
             try:
-                glat, glon = geocode_area(area)
+                glat, glon = await asyncio.to_thread(geocode_area, area)
                 if glat is not None and glon is not None:
                     lat = lat or glat
                     lon = lon or glon
@@ -116,7 +145,7 @@ async def heartbeat(payload: dict = Body(...)):
 async def geocode(area: str):
     """Server-side geocode lookup for an area name (uses Nominatim)."""
     try:
-        lat, lon = geocode_area(area)
+        lat, lon = await asyncio.to_thread(geocode_area, area)
         if lat is None or lon is None:
             raise HTTPException(404, "Not found")
         return JSONResponse({"area": area, "lat": lat, "lon": lon})
@@ -139,8 +168,8 @@ async def stats():
     """Current counts, traffic state, alerts, and ambulance priority."""
     state = get_traffic_state()
     recent = get_recent_totals()
-    from app.analytics import _history
-    last_counts = _history[-1].to_dict() if _history else {}
+    last = get_last_counts()
+    last_counts = last.to_dict() if last else {}
     return JSONResponse({
         "state": {
             "level": state.level,
@@ -161,13 +190,14 @@ async def detect_frame(file: UploadFile = File(...)):
         raise HTTPException(400, "Expected an image file")
     data = await file.read()
     buf = np.frombuffer(data, dtype=np.uint8)
-    frame = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    # Decode / inference / encode run in worker threads so the event loop keeps serving requests
+    frame = await asyncio.to_thread(cv2.imdecode, buf, cv2.IMREAD_COLOR)
     if frame is None:
         raise HTTPException(400, "Could not decode image")
-    result = run_detection_on_frame(frame)
+    result = await asyncio.to_thread(run_detection_on_frame, frame)
     update_history(result.counts)
-    _, jpeg = cv2.imencode(".jpg", result.frame_bgr)
-    img_b64 = f"data:image/jpeg;base64,{__import__('base64').b64encode(jpeg.tobytes()).decode()}"
+    jpeg_bytes = await asyncio.to_thread(_encode_jpeg, result.frame_bgr)
+    img_b64 = f"data:image/jpeg;base64,{b64encode(jpeg_bytes).decode()}"
     add_violations(result.violations, img_b64)
     return JSONResponse({
         "counts": result.counts.to_dict(),
@@ -181,27 +211,34 @@ async def detect_frame(file: UploadFile = File(...)):
     })
 
 
-def _generate_frames_from_video(video_bytes: bytes):
-    """Yield annotated frames as JPEG from uploaded video; record violations with last frame."""
-    import tempfile
-    buf = np.frombuffer(video_bytes, dtype=np.uint8)
-    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp:
-        tmp.write(video_bytes)
-        tmp.flush()
-        cap = cv2.VideoCapture(tmp.name)
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _generate_frames_from_video(video_path: str):
+    """Yield annotated frames as JPEG from an uploaded video file; record violations with their frame."""
+    cap = cv2.VideoCapture(video_path)
     try:
-        last_b64 = None
+        batch: list[np.ndarray] = []
         while True:
             ret, frame = cap.read()
+            if ret:
+                batch.append(frame)
+            # Run YOLO once per batch; flush the remainder at end of video
+            if batch and (not ret or len(batch) >= DETECT_BATCH_SIZE):
+                for result in run_detection_on_batch(batch):
+                    update_history(result.counts)
+                    jpeg_bytes = _encode_jpeg(result.frame_bgr)
+                    if result.violations:
+                        img_b64 = f"data:image/jpeg;base64,{b64encode(jpeg_bytes).decode()}"
+                        add_violations(result.violations, img_b64)
+                    yield _mjpeg_part(jpeg_bytes)
+                batch = []
             if not ret:
                 break
-            result = run_detection_on_frame(frame)
-            update_history(result.counts)
-            _, jpeg = cv2.imencode(".jpg", result.frame_bgr)
-            last_b64 = f"data:image/jpeg;base64,{__import__('base64').b64encode(jpeg.tobytes()).decode()}"
-            if result.violations:
-                add_violations(result.violations, last_b64)
-            yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n")
     finally:
         cap.release()
 
@@ -213,10 +250,21 @@ async def video_upload(file: UploadFile = File(...)):
         file.filename.lower().endswith(ext) for ext in (".mp4", ".avi", ".mov", ".webm")
     ):
         raise HTTPException(400, "Expected a video file (e.g. .mp4)")
-    data = await file.read()
+    # Spool the upload to disk in chunks (never the whole video in RAM); OpenCV decodes from the path
+    suffix = os.path.splitext(file.filename)[1].lower()
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, tmp, 1 << 20)
+        except BaseException:
+            # client abort / disk full: no response (and no cleanup task) will be created
+            tmp.close()
+            _remove_file(tmp.name)
+            raise
     return StreamingResponse(
-        _generate_frames_from_video(data),
+        _generate_frames_from_video(tmp.name),
         media_type="multipart/x-mixed-replace; boundary=frame",
+        # runs once the stream ends or the client disconnects
+        background=BackgroundTask(_remove_file, tmp.name),
     )
 
 
@@ -274,7 +322,7 @@ async def report_emergency(payload: dict = Body(...)):
     # fallback: geocode area name if provided
     if (lat is None or lon is None) and payload.get("area"):
         try:
-            glat, glon = geocode_area(payload.get("area"))
+            glat, glon = await asyncio.to_thread(geocode_area, payload.get("area"))
             lat = lat or glat
             lon = lon or glon
         except Exception:
@@ -319,7 +367,7 @@ async def download_challan_pdf(challan_id: str):
 async def camera_stream(device: int = 0):
     """Live stream from specified webcam index with detection (if available)."""
     try:
-        cap = cv2.VideoCapture(device)
+        cap = await asyncio.to_thread(cv2.VideoCapture, device)
     except Exception:
         raise HTTPException(503, "Cannot open camera")
     if not cap.isOpened():
@@ -333,12 +381,11 @@ async def camera_stream(device: int = 0):
                     break
                 result = run_detection_on_frame(frame)
                 update_history(result.counts)
+                jpeg_bytes = _encode_jpeg(result.frame_bgr)
                 if result.violations:
-                    _, jpeg = cv2.imencode(".jpg", result.frame_bgr)
-                    img_b64 = f"data:image/jpeg;base64,{__import__('base64').b64encode(jpeg.tobytes()).decode()}"
+                    img_b64 = f"data:image/jpeg;base64,{b64encode(jpeg_bytes).decode()}"
                     add_violations(result.violations, img_b64)
-                _, jpeg = cv2.imencode(".jpg", result.frame_bgr)
-                yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
+                yield _mjpeg_part(jpeg_bytes)
         finally:
             cap.release()
 
@@ -1,12 +1,15 @@
 """Violations: lane termination, accident, no-helmet, ambulance priority; challan store."""
 import io
+import threading
 import time
 import uuid
+from collections import deque
 from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import islice
 from typing import Optional
 
-import numpy as np
-
+from app._fast import accident_cluster, boxes_in_zone, pack_boxes
 from app.config import (
     ACCIDENT_MIN_IOU,
     ACCIDENT_MIN_VEHICLES,
@@ -39,30 +42,24 @@ class Challan:
     details: str = ""
 
 
-# In-memory stores (use DB in production)
-_violations: list[Violation] = []
-_challans: list[Challan] = []
+# In-memory stores (use DB in production); oldest entries drop off when full
+_violations: deque[Violation] = deque(maxlen=500)
+_challans: deque[Challan] = deque(maxlen=1000)
+# challan_id -> (status it was rendered with, PDF bytes)
+_pdf_cache: dict[str, tuple[str, bytes]] = {}
+# Stream generators append from threadpool threads; deques raise if mutated mid-iteration,
+# so writers and snapshot reads share this lock
+_store_lock = threading.Lock()
 _ambulance_detected = False
 _ambulance_manual_override = False
 _accident_alert: Optional[float] = None  # timestamp of last alert
 
 
-def _box_center(xyxy: np.ndarray) -> tuple[float, float]:
-    x1, y1, x2, y2 = xyxy[0], xyxy[1], xyxy[2], xyxy[3]
-    return ((x1 + x2) / 2, (y1 + y2) / 2)
-
-
-def _iou(box1: np.ndarray, box2: np.ndarray) -> float:
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    x2 = min(box1[2], box2[2])
-    y2 = min(box1[3], box2[3])
-    if x2 <= x1 or y2 <= y1:
-        return 0.0
-    inter = (x2 - x1) * (y2 - y1)
-    a1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
-    a2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
-    return inter / max(a1 + a2 - inter, 1e-6)
+@lru_cache(maxsize=8)
+def lane_zone_px(frame_height: int, frame_width: int) -> tuple[float, float, float, float]:
+    """Lane termination zone in pixels (x1, y1, x2, y2), cached per resolution."""
+    xmin, ymin, xmax, ymax = LANE_TERMINATION_ZONE
+    return (xmin * frame_width, ymin * frame_height, xmax * frame_width, ymax * frame_height)
 
 
 def check_lane_termination(
@@ -72,28 +69,22 @@ def check_lane_termination(
     boxes: list of (xyxy, cls_id, conf, class_name).
     """
     violations = []
-    xmin, ymin, xmax, ymax = LANE_TERMINATION_ZONE
-    zone_x1 = xmin * frame_width
-    zone_y1 = ymin * frame_height
-    zone_x2 = xmax * frame_width
-    zone_y2 = ymax * frame_height
-    for item in boxes:
-        xyxy = item[0]
+    zone_x1, zone_y1, zone_x2, zone_y2 = lane_zone_px(frame_height, frame_width)
+    for i in boxes_in_zone(pack_boxes(boxes), zone_x1, zone_y1, zone_x2, zone_y2):
+        item = boxes[i]
         class_name = item[3] if len(item) > 3 else "vehicle"
-        cx, cy = _box_center(np.array(xyxy))
-        if zone_x1 <= cx <= zone_x2 and zone_y1 <= cy <= zone_y2:
-            conf = item[2] if len(item) > 2 else 0.5
-            violations.append(
-                Violation(
-                    id=str(uuid.uuid4()),
-                    type="lane_termination",
-                    vehicle_class=class_name,
-                    confidence=float(conf),
-                    bbox=tuple(map(float, xyxy)),
-                    details="Vehicle in lane termination / no-entry zone",
-                    timestamp=time.time(),
-                )
+        conf = item[2] if len(item) > 2 else 0.5
+        violations.append(
+            Violation(
+                id=str(uuid.uuid4()),
+                type="lane_termination",
+                vehicle_class=class_name,
+                confidence=float(conf),
+                bbox=tuple(map(float, item[0])),
+                details="Vehicle in lane termination / no-entry zone",
+                timestamp=time.time(),
             )
+        )
     return violations
 
 
@@ -110,23 +101,17 @@ def check_accident(boxes: list[tuple], vehicle_class_names: set) -> Optional[Vio
     ]
     if len(vehicle_boxes) < ACCIDENT_MIN_VEHICLES:
         return None
-    for i, (b1, _, c1) in enumerate(vehicle_boxes):
-        overlap_count = 0
-        for j, (b2, _, c2) in enumerate(vehicle_boxes):
-            if i == j:
-                continue
-            if _iou(np.array(b1), np.array(b2)) >= ACCIDENT_MIN_IOU:
-                overlap_count += 1
-        if overlap_count >= ACCIDENT_MIN_VEHICLES - 1:
-            return Violation(
-                id=str(uuid.uuid4()),
-                type="accident",
-                vehicle_class="cluster",
-                confidence=0.9,
-                bbox=tuple(map(float, b1)),
-                details="Possible accident: multiple vehicles in collision zone",
-                timestamp=time.time(),
-            )
+    hit = accident_cluster(pack_boxes(vehicle_boxes), ACCIDENT_MIN_IOU, ACCIDENT_MIN_VEHICLES - 1)
+    if hit >= 0:
+        return Violation(
+            id=str(uuid.uuid4()),
+            type="accident",
+            vehicle_class="cluster",
+            confidence=0.9,
+            bbox=tuple(map(float, vehicle_boxes[hit][0])),
+            details="Possible accident: multiple vehicles in collision zone",
+            timestamp=time.time(),
+        )
     return None
 
 
@@ -156,15 +141,15 @@ def get_accident_alert() -> Optional[float]:
 def add_violations(new_ones: list[Violation], image_base64: Optional[str] = None) -> None:
     for v in new_ones:
         v.image_base64 = image_base64
-    _violations.extend(new_ones)
-    # Keep last 500
-    if len(_violations) > 500:
-        _violations[:] = _violations[-500:]
+    with _store_lock:
+        _violations.extend(new_ones)
 
 
 def get_recent_violations(limit: int = 50) -> list[dict]:
     out = []
-    for v in _violations[-limit:][::-1]:
+    with _store_lock:
+        recent = list(islice(reversed(_violations), max(limit, 0)))
+    for v in recent:
         out.append({
             "id": v.id,
             "type": v.type,
@@ -178,7 +163,8 @@ def get_recent_violations(limit: int = 50) -> list[dict]:
 
 
 def create_challan(violation_id: str) -> Optional[Challan]:
-    v = next((x for x in _violations if x.id == violation_id), None)
+    with _store_lock:
+        v = next((x for x in _violations if x.id == violation_id), None)
     if not v:
         return None
     amount = CHALLAN_AMOUNTS.get(v.type, 500)
@@ -194,11 +180,16 @@ def create_challan(violation_id: str) -> Optional[Challan]:
         created_at=time.time(),
         details=v.details,
     )
-    _challans.append(c)
+    with _store_lock:
+        if len(_challans) == _challans.maxlen:
+            _pdf_cache.pop(_challans[0].id, None)
+        _challans.append(c)
     return c
 
 
 def get_challans() -> list[dict]:
+    with _store_lock:
+        challans = list(reversed(_challans))
     return [
         {
             "id": c.id,
@@ -210,14 +201,19 @@ def get_challans() -> list[dict]:
             "created_at": c.created_at,
             "details": c.details,
         }
-        for c in reversed(_challans)
+        for c in challans
     ]
 
 
 def get_challan_pdf(challan_id: str) -> Optional[bytes]:
-    c = next((x for x in _challans if x.id == challan_id), None)
+    with _store_lock:
+        c = next((x for x in _challans if x.id == challan_id), None)
     if not c:
         return None
+    # Rendered PDFs only change with status, so re-render only if that differs
+    cached = _pdf_cache.get(challan_id)
+    if cached and cached[0] == c.status:
+        return cached[1]
     try:
         from reportlab.lib.pagesizes import A4
         from reportlab.pdfgen import canvas
@@ -237,5 +233,6 @@ def get_challan_pdf(challan_id: str) -> Optional[bytes]:
     p.drawString(72, 620, "Please pay at the nearest traffic office or online portal.")
     p.showPage()
     p.save()
-    buf.seek(0)
-    return buf.read()
+    pdf_bytes = buf.getvalue()
+    _pdf_cache[challan_id] = (c.status, pdf_bytes)
+    return pdf_bytes